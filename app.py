@@ -10,12 +10,14 @@
 # specific language governing permissions and limitations under
 # each license.
 
-from flask import Flask, request, abort
+from flask import Flask, Response, request, abort, send_file
 from waitress import serve
 import logging
 import json
 import io
+import math
 import os
+import tempfile
 import boto3
 import base64
 from flask_cors import CORS
@@ -23,6 +25,7 @@ from c2pa import Builder, C2paSigningAlg, Signer
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import ec
 from cryptography.hazmat.backends import default_backend
+from jobs import JobScheduler, PRIORITIES
 
 
 # Load environment variable from .env file
@@ -41,7 +44,7 @@ logging.basicConfig(level=logging.INFO)
 
 # Run Flask app
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['C2PA-Embed-Offset', 'C2PA-Embed-Length'])
 
 # Load env vars with a given prefix into APP config
 # By default, env vars with the `FLASK_`` prefix
@@ -125,14 +128,24 @@ except AttributeError:
     raise ValueError(f"Unsupported signing algorithm: {signing_alg_str}")
 
 
-@app.route("/attach", methods=["POST"])
-def attach_sign_image():
-    """Gets a JPEG image to sign and returns the signed JPEG image"""
+# Output modes supported by /attach:
+# - full: the whole signed asset (default)
+# - sidecar: only the manifest store (.c2pa), bound to the unmodified asset
+# - embeddable: only the bytes to insert into the asset, with the insertion offset
+OUTPUT_MODES = ('full', 'sidecar', 'embeddable')
+
+# Chunk size used when comparing original and signed assets
+COMPARE_CHUNK_SIZE = 1024 * 1024
+
+
+class EmbeddingError(Exception):
+    """Raised when a signed asset cannot be described as a single insertion"""
 
-    request_data = request.get_data()
-    content_type = request.headers.get('Content-Type', 'image/jpeg')  # Default to 'image/jpeg' if not provided
 
-    manifest = json.dumps({
+def build_manifest():
+    """Returns the manifest definition used when signing assets"""
+
+    return json.dumps({
         "title": "image.jpg",
         "format": "image/jpeg",
         "claim_generator_info": [
@@ -160,26 +173,259 @@ def attach_sign_image():
         ]
     })
 
+
+def create_signer():
+    """Creates a signer using local keys if set, otherwise KMS"""
+
+    callback_func = es256_sign if private_key is not None else kms_sign
+    return Signer.from_callback(
+        callback=callback_func,
+        alg=signing_alg,
+        certs=cert_chain,
+        tsa_url=timestamp_url
+    )
+
+
+def find_inserted_range(original, signed):
+    """ Compares the original and signed streams and returns the (offset, length)
+        of the single block of bytes inserted by signing, or None if signing
+        changed the asset in any other way. """
+
+    original_size = original.seek(0, io.SEEK_END)
+    signed_size = signed.seek(0, io.SEEK_END)
+    inserted_length = signed_size - original_size
+    if inserted_length <= 0:
+        return None
+
+    # Length of the common prefix
+    original.seek(0)
+    signed.seek(0)
+    prefix_length = 0
+    while prefix_length < original_size:
+        a = original.read(COMPARE_CHUNK_SIZE)
+        b = signed.read(len(a))
+        if a != b:
+            prefix_length += next(i for i, (x, y) in enumerate(zip(a, b)) if x != y)
+            break
+        prefix_length += len(a)
+
+    # Length of the common suffix
+    suffix_length = 0
+    while suffix_length < original_size:
+        size = min(COMPARE_CHUNK_SIZE, original_size - suffix_length)
+        original.seek(original_size - suffix_length - size)
+        signed.seek(signed_size - suffix_length - size)
+        a = original.read(size)
+        b = signed.read(size)
+        if a != b:
+            suffix_length += next(i for i, (x, y) in enumerate(zip(reversed(a), reversed(b))) if x != y)
+            break
+        suffix_length += size
+
+    # Signing only inserted a block if the prefix and suffix cover the original
+    if prefix_length + suffix_length < original_size:
+        return None
+
+    # The block can start anywhere the prefix and suffix overlap. Use the leftmost
+    # point, so that the block starts where the inserted data does (for example
+    # at the JPEG marker of the inserted segments) rather than at a shared byte
+    offset = min(prefix_length, original_size - suffix_length)
+    return offset, inserted_length
+
+
+def copy_range(source, dest, offset, length):
+    """Copies length bytes starting at offset from source to dest"""
+
+    source.seek(offset)
+    while length > 0:
+        chunk = source.read(min(COMPARE_CHUNK_SIZE, length))
+        if not chunk:
+            break
+        dest.write(chunk)
+        length -= len(chunk)
+
+
+def sign_asset(source, dest, content_type, output='full'):
+    """ Signs the asset read from source and writes the requested output to dest.
+        Returns the response mimetype and any additional response headers. """
+
+    with Builder(build_manifest()) as builder:
+        signer = create_signer()
+
+        if output == 'full':
+            builder.sign(signer, content_type, source, dest)
+            return content_type, {}
+
+        if output == 'sidecar':
+            # The manifest store is bound to the asset as-is, so the
+            # copy written by the builder is not needed
+            builder.set_no_embed()
+            with tempfile.TemporaryFile() as scratch:
+                manifest_bytes = builder.sign(signer, content_type, source, scratch)
+            dest.write(manifest_bytes)
+            return 'application/c2pa', {}
+
+        with tempfile.TemporaryFile() as scratch:
+            builder.sign(signer, content_type, source, scratch)
+            inserted = find_inserted_range(source, scratch)
+            if inserted is None:
+                raise EmbeddingError(
+                    f'Signed {content_type} asset is not the original with a single inserted block, use full output instead')
+            offset, length = inserted
+            copy_range(scratch, dest, offset, length)
+
+        return 'application/octet-stream', {
+            'C2PA-Embed-Offset': str(offset),
+            'C2PA-Embed-Length': str(length),
+        }
+
+
+@app.route("/attach", methods=["POST"])
+def attach_sign_image():
+    """ Gets a JPEG image to sign and returns the signed JPEG image.
+        With ?output=sidecar, returns only the manifest store instead.
+        With ?output=embeddable, returns only the bytes to insert into the
+        image, at the offset given by the C2PA-Embed-Offset header. """
+
+    request_data = request.get_data()
+    content_type = request.headers.get('Content-Type', 'image/jpeg')  # Default to 'image/jpeg' if not provided
+    output = request.args.get('output', 'full')
+
+    if output not in OUTPUT_MODES:
+        abort(400, description=f"Unsupported output mode: {output}")
+
     try:
-        with Builder(manifest) as builder:
-            # Create signer using the new API
-            callback_func = es256_sign if private_key is not None else kms_sign
-            signer = Signer.from_callback(
-                callback=callback_func,
-                alg=signing_alg,
-                certs=cert_chain,
-                tsa_url=timestamp_url
-            )
-
-            result = io.BytesIO(b"")
-            builder.sign(signer, content_type, io.BytesIO(request_data), result)
-
-            return result.getvalue()
+        result = io.BytesIO(b"")
+        mimetype, headers = sign_asset(io.BytesIO(request_data), result, content_type, output)
+        return Response(result.getvalue(), mimetype=mimetype, headers=headers)
+    except EmbeddingError as e:
+        logging.error(e)
+        abort(422, description=e)
     except Exception as e:
         logging.error(e)
         abort(500, description=e)
 
 
+def run_signing_job(input_path, output_path, params):
+    """Signs a spooled asset for an asynchronous signing job"""
+
+    with open(input_path, 'rb') as source, open(output_path, 'w+b') as dest:
+        mimetype, headers = sign_asset(source, dest, params['content_type'], params['output'])
+    return {'mimetype': mimetype, 'headers': headers}
+
+
+# Configure asynchronous signing jobs
+job_spool_dir = app_config.get('JOB_SPOOL_DIR') or 'job_spool'
+job_workers = int(app_config.get('JOB_WORKERS') or 2)
+job_result_ttl = int(app_config.get('JOB_RESULT_TTL_SECONDS') or 3600)
+job_large_asset_bytes = int(app_config.get('JOB_LARGE_ASSET_BYTES') or 16 * 1024 * 1024)
+# Largest request body waitress accepts, for /jobs and /attach alike (waitress' default is 1 GiB)
+job_max_upload_bytes = int(app_config.get('JOB_MAX_UPLOAD_BYTES') or 1024 * 1024 * 1024)
+
+# Longest time a client can wait for a job to finish in a single status request.
+# Each waiting request holds one of waitress' threads (4 by default), so keep
+# this short enough that waiting clients do not block other requests for long
+MAX_JOB_WAIT_SECONDS = 5
+
+job_scheduler = JobScheduler(job_spool_dir,
+                             run_signing_job,
+                             workers=job_workers,
+                             result_ttl=job_result_ttl,
+                             large_asset_bytes=job_large_asset_bytes)
+job_scheduler.start()
+print(f'Using job spool: {job_spool_dir} with {job_workers} workers')
+
+
+def job_status(job):
+    """Returns the public status of a job as JSON"""
+
+    return json.dumps({
+        "id": job['id'],
+        "status": job['status'],
+        "priority": job['priority'],
+        "size": job['size'],
+        "output": job['params']['output'],
+        "error": job['error'],
+        "created_at": job['created_at'],
+        "started_at": job['started_at'],
+        "finished_at": job['finished_at'],
+        "expires_at": job['expires_at'],
+        "result_url": f"{request.host_url}jobs/{job['id']}/result" if job['status'] == 'done' else None
+    })
+
+
+@app.route("/jobs", methods=["POST"])
+def submit_job():
+    """ Gets a JPEG image to sign asynchronously and returns the queued job.
+        Accepts the same output modes as /attach, and a priority of
+        high, normal (default) or low. """
+
+    content_type = request.headers.get('Content-Type', 'image/jpeg')  # Default to 'image/jpeg' if not provided
+    output = request.args.get('output', 'full')
+    priority = request.args.get('priority', 'normal')
+
+    if output not in OUTPUT_MODES:
+        abort(400, description=f"Unsupported output mode: {output}")
+    if priority not in PRIORITIES:
+        abort(400, description=f"Unsupported job priority: {priority}")
+
+    try:
+        job = job_scheduler.submit(request.stream,
+                                   {'content_type': content_type, 'output': output},
+                                   priority)
+    except Exception as e:
+        logging.error(e)
+        abort(500, description=e)
+
+    return Response(job_status(job), status=202, mimetype='application/json',
+                    headers={'Location': f"{request.host_url}jobs/{job['id']}"})
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """ Returns the status of a signing job.
+        With ?wait=<seconds>, waits for the job to finish before returning. """
+
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = None
+    if wait is None or not math.isfinite(wait):
+        abort(400, description="wait must be a number of seconds")
+    wait = min(max(wait, 0), MAX_JOB_WAIT_SECONDS)
+
+    job = job_scheduler.get(job_id, wait=wait)
+    if job is None:
+        abort(404, description=f"Unknown or expired job: {job_id}")
+    return Response(job_status(job), mimetype='application/json')
+
+
+@app.route("/jobs/<job_id>/result", methods=["GET"])
+def get_job_result(job_id):
+    """Returns the output of a finished signing job"""
+
+    job = job_scheduler.get(job_id)
+    if job is None:
+        abort(404, description=f"Unknown or expired job: {job_id}")
+    if job['status'] == 'failed':
+        abort(500, description=job['error'])
+    if job['status'] != 'done':
+        abort(409, description=f"Job {job_id} is {job['status']}")
+
+    response = send_file(job_scheduler.result_path(job_id), mimetype=job['result']['mimetype'])
+    response.headers.update(job['result']['headers'])
+    return response
+
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+def delete_job(job_id):
+    """Deletes a signing job that is not running, and its result"""
+
+    if not job_scheduler.delete(job_id):
+        abort(409 if job_scheduler.get(job_id) is not None else 404)
+    return Response(status=204)
+
+
 # Uses ES256 alg to sign
 def es256_sign(data: bytes) -> bytes:
     """Signs the data using ES256 algorithm with the private key"""
@@ -268,4 +514,4 @@ if __name__ == '__main__':
 
     # For additional debugging info, uncomment the line below:
     # app.run(debug=True)
-    serve(app, host=host, port=port)
+    serve(app, host=host, port=port, max_request_body_size=job_max_upload_bytes)
@@ -0,0 +1,260 @@
+# Copyright 2024 Adobe. All rights reserved.
+# This file is licensed to you under the Apache License,
+# Version 2.0 (http://www.apache.org/licenses/LICENSE-2.0)
+# or the MIT license (http://opensource.org/licenses/MIT),
+# at your option.
+# Unless required by applicable law or agreed to in writing,
+# this software is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR REPRESENTATIONS OF ANY KIND, either express or
+# implied. See the LICENSE-MIT and LICENSE-APACHE files for the
+# specific language governing permissions and limitations under
+# each license.
+
+import heapq
+import itertools
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+# Job priorities, lower rank runs first
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+# Files kept in each job's spool directory
+INPUT_FILE = 'input'
+OUTPUT_FILE = 'output'
+STATUS_FILE = 'job.json'
+
+
+class JobScheduler:
+    """ Runs jobs on a bounded pool of worker threads, keeping each job's
+        input, output and status in its own directory of an on-disk spool.
+
+        Jobs with inputs larger than large_asset_bytes may use at most
+        workers - 1 workers at once, so that small jobs always have
+        a worker available. With a single worker, large jobs use it too,
+        as they would otherwise never run. """
+
+    def __init__(self, spool_dir, handler, workers=2, result_ttl=3600,
+                 large_asset_bytes=16 * 1024 * 1024):
+        # handler(input_path, output_path, params) -> dict, called on a worker thread
+        self.spool_dir = spool_dir
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.result_ttl = result_ttl
+        self.large_asset_bytes = large_asset_bytes
+        self.max_large_running = max(1, self.workers - 1)
+
+        self._jobs = {}
+        self._small_queue = []
+        self._large_queue = []
+        self._large_running = 0
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+
+    def start(self):
+        """Recovers jobs left in the spool and starts the worker threads"""
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._recover()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        janitor = threading.Thread(target=self._sweep, name='job-janitor', daemon=True)
+        janitor.start()
+        self._threads.append(janitor)
+
+    def submit(self, stream, params, priority='normal'):
+        """Spools the input read from stream and queues a job for it"""
+
+        if priority not in PRIORITIES:
+            raise ValueError(f'Unsupported job priority: {priority}')
+
+        job_id = uuid.uuid4().hex
+        job_dir = self._job_dir(job_id)
+        os.makedirs(job_dir)
+        with open(os.path.join(job_dir, INPUT_FILE), 'wb') as f:
+            shutil.copyfileobj(stream, f)
+
+        job = {
+            'id': job_id,
+            'status': 'queued',
+            'priority': priority,
+            'size': os.path.getsize(os.path.join(job_dir, INPUT_FILE)),
+            'params': params,
+            'result': None,
+            'error': None,
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'expires_at': None,
+        }
+
+        with self._condition:
+            self._save(job)
+            self._jobs[job_id] = job
+            self._enqueue(job)
+            self._condition.notify_all()
+
+        logging.info(f'Queued job {job_id} ({job["size"]} bytes, {priority} priority)')
+        return dict(job)
+
+    def get(self, job_id, wait=0):
+        """ Returns a copy of the job, or None if it does not exist.
+            Waits up to wait seconds for the job to finish. """
+
+        deadline = time.monotonic() + wait
+        with self._condition:
+            while True:
+                job = self._jobs.get(job_id)
+                if job is None:
+                    return None
+                remaining = deadline - time.monotonic()
+                if job['status'] in ('done', 'failed') or remaining <= 0:
+                    return dict(job)
+                self._condition.wait(remaining)
+
+    def result_path(self, job_id):
+        """Returns the path of the job's output file"""
+
+        return os.path.join(self._job_dir(job_id), OUTPUT_FILE)
+
+    def delete(self, job_id):
+        """ Deletes a job that is not running and its spooled files.
+            Returns False if the job does not exist or is running. """
+
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job['status'] == 'running':
+                return False
+            del self._jobs[job_id]
+
+        shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+        logging.info(f'Deleted job {job_id}')
+        return True
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.spool_dir, job_id)
+
+    def _is_large(self, job):
+        return job['size'] > self.large_asset_bytes
+
+    def _enqueue(self, job):
+        queue = self._large_queue if self._is_large(job) else self._small_queue
+        heapq.heappush(queue, (PRIORITIES[job['priority']], next(self._sequence), job['id']))
+
+    def _save(self, job):
+        """Writes the job status file, replacing the previous one atomically"""
+
+        status_path = os.path.join(self._job_dir(job['id']), STATUS_FILE)
+        with open(status_path + '.tmp', 'w') as f:
+            json.dump(job, f)
+        os.replace(status_path + '.tmp', status_path)
+
+    def _recover(self):
+        """Loads jobs from the spool, queueing again any that did not finish"""
+
+        for job_id in os.listdir(self.spool_dir):
+            status_path = os.path.join(self._job_dir(job_id), STATUS_FILE)
+            try:
+                with open(status_path) as f:
+                    job = json.load(f)
+            except (OSError, ValueError):
+                logging.warning(f'Removing unreadable job directory {job_id}')
+                shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+                continue
+
+            if job['status'] in ('queued', 'running'):
+                job['status'] = 'queued'
+                job['started_at'] = None
+                self._save(job)
+            self._jobs[job_id] = job
+
+        # Queue unfinished jobs in submission order, as they were before
+        unfinished = [job for job in self._jobs.values() if job['status'] == 'queued']
+        for job in sorted(unfinished, key=lambda job: job['created_at']):
+            self._enqueue(job)
+
+        if self._jobs:
+            logging.info(f'Recovered {len(self._jobs)} jobs from {self.spool_dir}')
+
+    def _next_job(self):
+        """ Pops the next job to run, or returns None if no queued job can run.
+            Must be called with the condition held. """
+
+        while True:
+            candidates = []
+            if self._small_queue:
+                candidates.append(self._small_queue)
+            if self._large_queue and self._large_running < self.max_large_running:
+                candidates.append(self._large_queue)
+            if not candidates:
+                return None
+
+            _, _, job_id = heapq.heappop(min(candidates, key=lambda queue: queue[0]))
+            job = self._jobs.get(job_id)
+            # Skip jobs deleted while queued
+            if job is not None and job['status'] == 'queued':
+                return job
+
+    def _work(self):
+        while True:
+            with self._condition:
+                job = self._next_job()
+                while job is None:
+                    self._condition.wait()
+                    job = self._next_job()
+
+                large = self._is_large(job)
+                if large:
+                    self._large_running += 1
+                job['status'] = 'running'
+                job['started_at'] = time.time()
+                self._save(job)
+
+            try:
+                result = self.handler(os.path.join(self._job_dir(job['id']), INPUT_FILE),
+                                      self.result_path(job['id']),
+                                      job['params'])
+                status, error = 'done', None
+            except Exception as e:
+                logging.error(f'Job {job["id"]} failed: {e}')
+                result, status, error = None, 'failed', str(e)
+
+            # The input is no longer needed once the job has finished
+            try:
+                os.remove(os.path.join(self._job_dir(job['id']), INPUT_FILE))
+            except OSError:
+                pass
+
+            with self._condition:
+                if large:
+                    self._large_running -= 1
+                job['status'] = status
+                job['result'] = result
+                job['error'] = error
+                job['finished_at'] = time.time()
+                job['expires_at'] = job['finished_at'] + self.result_ttl
+                self._save(job)
+                self._condition.notify_all()
+
+            logging.info(f'Job {job["id"]} {status}')
+
+    def _sweep(self):
+        """Periodically deletes finished jobs whose retention time has passed"""
+
+        while True:
+            time.sleep(max(1, min(self.result_ttl, 60)))
+            now = time.time()
+            with self._condition:
+                expired = [job_id for job_id, job in self._jobs.items()
+                           if job['expires_at'] is not None and job['expires_at'] <= now]
+            for job_id in expired:
+                self.delete(job_id)
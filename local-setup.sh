@@ -54,6 +54,7 @@ EOT
     cat <<EOT >> .env.local
 APP_ENDPOINT=0.0.0.0
 APP_HOST_PORT=5000
+JOB_SPOOL_DIR=local_volume/job_spool
 EOT
 
     echo "Copying .env.local to local_volume/.env"
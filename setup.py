@@ -13,6 +13,9 @@ import hashlib
 import base64
 import textwrap
 import os
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from botocore.config import Config
 from cryptography import x509
 from cryptography.x509.oid import NameOID
 from cryptography.hazmat.primitives import hashes
@@ -32,9 +35,11 @@ hash_alg = 'ECDSA_SHA_256'
 # [^1]: https://cryptography.io/en/latest/x509/reference/#cryptography.x509.oid.SignatureAlgorithmOID.ECDSA_WITH_SHA256
 sign_oid = '1.2.840.10045.4.3.2'
 csr_file = 'kms-signing.csr'
+# Retry throttled and transient KMS errors, backing off as needed
+kms_retries = {'mode': 'adaptive', 'max_attempts': 10}
 
 
-def read_env_params(env_file_path=None):
+def read_env_params(env_file_path=None, max_pool_connections=10):
   """Read environment variables from a given file path or default .env file"""
 
   if env_file_path is not None:
@@ -53,6 +58,7 @@ def read_env_params(env_file_path=None):
 
   kms = None
   run_mode = app_config['RUN_MODE']
+  kms_config = Config(retries=kms_retries, max_pool_connections=max_pool_connections)
 
   if 'RUN_MODE' in app_config and run_mode == 'DEV':
       # Run in dev/local mode (eg. with LocalStack)
@@ -69,7 +75,8 @@ def read_env_params(env_file_path=None):
                             endpoint_url=endpoint_url,
                             region_name=region,
                             aws_access_key_id=aws_access_key_id,
-                            aws_secret_access_key=aws_secret_access_key)
+                            aws_secret_access_key=aws_secret_access_key,
+                            config=kms_config)
       except Exception as e:
         print('Error during KMS client setup in dev mode:')
         print(e)
@@ -77,11 +84,33 @@ def read_env_params(env_file_path=None):
 
   else:
       # Example setup for use with AWS credentials setup (no LocalStack use)
-      kms = boto3.client('kms')
+      kms = boto3.client('kms', config=kms_config)
 
   return kms
 
 
+def create_signing_key(kms):
+    """Create a KMS signing key using a KMS client and return its key ID"""
+
+    try:
+      response = kms.create_key(
+          Description='C2PA Python KMS Demo Key',
+          KeyUsage='SIGN_VERIFY',
+          KeySpec='ECC_NIST_P256',
+      )
+    except Exception as e:
+      print(f'Error during KMS key creation: {e}')
+      raise Exception('No KMS key id generated (Error during KMS key creation)')
+
+    key_id = response['KeyMetadata']['KeyId']
+
+    if key_id is None:
+      print('Error during KMS key creation')
+      raise Exception('No KMS key id generated')
+
+    return key_id
+
+
 def create_kms_key(env_file_path=None):
     """Create KMS key and set environment variables (KMS key ID)."""
 
@@ -94,25 +123,11 @@ def create_kms_key(env_file_path=None):
         kms = read_env_params()
 
 
-    try:
-      if kms is not None:
-        response = kms.create_key(
-            Description='C2PA Python KMS Demo Key',
-            KeyUsage='SIGN_VERIFY',
-            KeySpec='ECC_NIST_P256',
-        )
-      else:
-        print('Error during KMS client setup')
-        raise Exception('No KMS key id generated (Error during KMS client setup)')
-    except Exception as e:
-      print(f'Error during KMS key creation: {e}')
-      raise Exception('No KMS key id generated (Error during KMS key creation)')
-
-    key_id = response['KeyMetadata']['KeyId']
+    if kms is None:
+      print('Error during KMS client setup')
+      raise Exception('No KMS key id generated (Error during KMS client setup)')
 
-    if key_id is None:
-      print('Error during KMS key creation')
-      raise Exception('No KMS key id generated')
+    key_id = create_signing_key(kms)
 
     print(f'Created KMS key: {key_id}')
     os.environ['KMS_KEY_ID'] = key_id
@@ -166,9 +181,12 @@ def generate_certificate_request(kms_key: str, subject: str, env_file_path=None)
         print(f'Using default environment to build environment and KMS client')
         kms = read_env_params()
 
-    key_obj = kms.describe_key(KeyId=kms_key)
-    # Show structure of key object
-    # print(key_obj)
+    with open(csr_file, "w") as f:
+        f.write(build_certificate_request(kms, kms_key, subject))
+
+
+def build_certificate_request(kms, kms_key, subject):
+    """Build a PEM encoded CSR for a KMS key using a KMS client"""
 
     # Get public key from KMS
     response = kms.get_public_key(KeyId=kms_key)
@@ -234,10 +252,86 @@ def generate_certificate_request(kms_key: str, subject: str, env_file_path=None)
         'signatureAlgorithm', sigAlgIdentifier)
     csr_request.setComponentByName(
         'signature', univ.BitString.fromOctetString(signature))
-    build_output(csr_request)
 
-    with open(csr_file, "w") as f:
-        f.write(build_output(csr_request))
+    return build_output(csr_request)
+
+
+# Example call: python setup.py create-keys-and-csrs 'CN=Tenant {index},O=C2PA Python Demo' 10 './my-env-file.env' --output-dir csrs
+@arguably.command
+def create_keys_and_csrs(subject, count: int, env_file_path=None, *, output_dir='csrs', workers: int = 8):
+    """Create count KMS keys and their CSR signing request files concurrently
+
+    Args:
+        subject: CSR subject, where the word index in curly braces is replaced by the key's index
+        count: number of keys to create
+        env_file_path: env file to build the KMS client from
+        output_dir: directory to write CSR files and index.json to, adding to any existing index.json
+        workers: number of keys to create at the same time
+    """
+
+    # Check all parameters before creating any key, as keys cannot be given back for free
+    if count < 1:
+        raise Exception(f'Number of keys to create must be at least 1, got {count}')
+    if workers < 1:
+        raise Exception(f'Number of workers must be at least 1, got {workers}')
+
+    subjects = [subject.replace('{index}', str(index)) for index in range(count)]
+    for index, key_subject in enumerate(subjects):
+        try:
+            Name.from_rfc4514_string(key_subject)
+        except Exception as e:
+            raise Exception(f'Invalid CSR subject for key {index}: {key_subject!r} ({e!r})')
+
+    # Keys from earlier runs into the same directory stay listed in index.json
+    index_path = os.path.join(output_dir, 'index.json')
+    existing_keys = []
+    if os.path.exists(index_path):
+        try:
+            with open(index_path) as f:
+                existing_keys = json.load(f)['keys']
+        except Exception as e:
+            raise Exception(f'Could not read existing {index_path}, fix or move it before creating more keys ({e!r})')
+        print(f'Adding to {len(existing_keys)} KMS keys already listed in {index_path}')
+
+    kms = read_env_params(env_file_path, max_pool_connections=workers)
+    os.makedirs(output_dir, exist_ok=True)
+
+    def provision(index):
+        key_id = create_signing_key(kms)
+        csr_path = os.path.join(output_dir, f'kms-signing-{key_id}.csr')
+        try:
+            with open(csr_path, "w") as f:
+                f.write(build_certificate_request(kms, key_id, subjects[index]))
+        except Exception as e:
+            # Keep track of the created key, so it can be reused or deleted
+            print(f'Error during CSR creation for KMS key {key_id}: {e!r}')
+            return {'index': index, 'key_id': key_id, 'csr_path': None, 'error': repr(e)}
+        print(f'Created KMS key {key_id} and CSR {csr_path}')
+        return {'index': index, 'key_id': key_id, 'csr_path': csr_path, 'error': None}
+
+    keys = []
+    failures = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(provision, index) for index in range(count)]
+        for future in as_completed(futures):
+            try:
+                key = future.result()
+            except Exception as e:
+                print(f'Error during KMS key creation: {e!r}')
+                failures += 1
+                continue
+            keys.append(key)
+            if key['error'] is not None:
+                failures += 1
+
+    keys.sort(key=lambda key: key['index'])
+    with open(index_path + '.tmp', "w") as f:
+        json.dump({'keys': existing_keys + keys}, f, indent=2)
+    os.replace(index_path + '.tmp', index_path)
+    print(f'Created {len(keys)} KMS keys, listed in {index_path}')
+
+    if failures:
+        raise Exception(f'{failures} of {count} KMS keys or CSRs could not be created, see {index_path} for created keys without a CSR')
 
 
 def build_output(csr):
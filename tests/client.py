@@ -14,7 +14,7 @@ import argparse
 import os
 import requests
 import json
-from c2pa import Builder, Signer, C2paSigningAlg
+from c2pa import Builder, Reader, Signer, C2paSigningAlg
 from PIL import Image
 import io
 import base64
@@ -27,8 +27,14 @@ from dotenv import dotenv_values
 # Example call using a config env file
 # python tests/client.py ./image-to-sign.jpeg  -o out-images -f ./my-example-env-file.env
 
-def get_signer_data_uri(env_file_path=None):
-    uri = "http://localhost:5000/signer_data"
+# Example call signing with the server's /attach endpoint, only downloading the bytes to embed
+# python tests/client.py ./image-to-sign.jpeg  -o out-images --attach-output embeddable
+
+# Example call signing with an asynchronous signing job on the server
+# python tests/client.py ./image-to-sign.jpeg  -o out-images --jobs
+
+def get_server_uri(env_file_path=None):
+    uri = "http://localhost:5000"
     app_config = None
 
     if env_file_path is not None:
@@ -53,7 +59,7 @@ def get_signer_data_uri(env_file_path=None):
             client_protocol = app_config['CLIENT_PROTOCOL']
 
         if host_port is not None and client_endpoint is not None and client_protocol is not None:
-            uri = f'{client_protocol}://{client_endpoint}:{host_port}/signer_data'
+            uri = f'{client_protocol}://{client_endpoint}:{host_port}'
         else:
             raise ValueError(f'Invalid configuration: Cannot build endpoint URL.. Missing one of CLIENT_HOST_PORT, CLIENT_ENDPOINT, CLIENT_PROTOCOL')
 
@@ -113,6 +119,114 @@ def make_thumbnail(file: str) -> io.BytesIO:
         return buffer
 
 
+# Sign a file with the server's /attach endpoint using the given output mode
+def attach(server_uri: str, file: str, output: str) -> requests.Response:
+    with open(file, 'rb') as f:
+        response = requests.post(f'{server_uri}/attach',
+                                 params={'output': output},
+                                 headers={'Content-Type': 'image/jpeg'},
+                                 data=f)
+    if response.status_code != 200:
+        raise ValueError(f"Failed to sign with {output} output: {response.status_code} {response.text}")
+    return response
+
+# Sign a file with an asynchronous signing job using the given output mode
+# Submits the job, waits for it to finish, downloads the result and deletes the job
+def run_job(server_uri: str, file: str, output: str) -> requests.Response:
+    with open(file, 'rb') as f:
+        response = requests.post(f'{server_uri}/jobs',
+                                 params={'output': output},
+                                 headers={'Content-Type': 'image/jpeg'},
+                                 data=f)
+    if response.status_code != 202:
+        raise ValueError(f"Failed to submit job: {response.status_code} {response.text}")
+    job = response.json()
+    print(f"Submitted job {job['id']} ({job['status']})")
+
+    job_uri = f"{server_uri}/jobs/{job['id']}"
+    while job['status'] in ('queued', 'running'):
+        response = requests.get(job_uri, params={'wait': 5})
+        if response.status_code != 200:
+            raise ValueError(f"Failed to get job status: {response.status_code} {response.text}")
+        job = response.json()
+        print(f"Job {job['id']} is {job['status']}")
+
+    if job['status'] != 'done':
+        raise ValueError(f"Job {job['id']} {job['status']}: {job['error']}")
+
+    result = requests.get(f'{job_uri}/result')
+    if result.status_code != 200:
+        raise ValueError(f"Failed to download job result: {result.status_code} {result.text}")
+
+    response = requests.delete(job_uri)
+    if response.status_code != 204:
+        raise ValueError(f"Failed to delete job: {response.status_code} {response.text}")
+
+    return result
+
+# Rebuild the signed file from embeddable output, checking it against full output
+# Manifests differ between signings (signature, timestamp), so only the bytes
+# around the inserted manifest and its first JPEG marker are compared
+def rebuild_from_embeddable(original: bytes, embeddable: requests.Response, full: bytes) -> bytes:
+    offset = int(embeddable.headers['C2PA-Embed-Offset'])
+    length = int(embeddable.headers['C2PA-Embed-Length'])
+    if len(embeddable.content) != length:
+        raise ValueError(f"Embeddable output is {len(embeddable.content)} bytes, expected {length}")
+
+    # The inserted bytes are JPEG segments, so they start with a marker
+    if not embeddable.content.startswith(b'\xff'):
+        raise ValueError(f"Embeddable output does not start with a JPEG marker: {embeddable.content[:4].hex(' ')}")
+
+    rebuilt = original[:offset] + embeddable.content + original[offset:]
+
+    full_length = len(full) - len(original)
+    if full[:offset] != rebuilt[:offset] or full[offset + full_length:] != original[offset:]:
+        raise ValueError("Embeddable output is not inserted where full output places the manifest")
+    # Full output inserts the same segment at the same offset
+    if full[offset:offset + 2] != embeddable.content[:2]:
+        raise ValueError(f"Full output has marker {full[offset:offset + 2].hex(' ')} at offset {offset}, "
+                         f"embeddable output starts with {embeddable.content[:2].hex(' ')}")
+    print(f"Embedded {length} bytes at offset {offset} (full output inserted {full_length} bytes)")
+
+    return rebuilt
+
+# Read the manifest store of a signed file, or of a file and its sidecar manifest
+def read_manifest_store(data: bytes, manifest_data: bytes = None) -> dict:
+    with Reader("image/jpeg", io.BytesIO(data), manifest_data=manifest_data) as reader:
+        manifest_store = json.loads(reader.json())
+    if not manifest_store.get("active_manifest"):
+        raise ValueError("No active manifest found")
+    print(f"Read active manifest {manifest_store['active_manifest']}")
+    for status in manifest_store.get("validation_status", []):
+        print(f" Validation status: {status.get('code')} {status.get('explanation', '')}")
+    return manifest_store
+
+# Sign a file with /attach (or a signing job) and save the output mode's result
+def sign_with_attach(server_uri: str, file: str, output: str, output_file: str, use_jobs: bool = False):
+    sign_request = run_job if use_jobs else attach
+
+    with open(file, 'rb') as f:
+        original = f.read()
+
+    if output == 'sidecar':
+        manifest_data = sign_request(server_uri, file, output).content
+        read_manifest_store(original, manifest_data)
+        output_file = os.path.splitext(output_file)[0] + '.c2pa'
+        signed = manifest_data
+    elif output == 'embeddable':
+        embeddable = sign_request(server_uri, file, output)
+        full = sign_request(server_uri, file, 'full').content
+        signed = rebuild_from_embeddable(original, embeddable, full)
+        read_manifest_store(signed)
+    else:
+        signed = sign_request(server_uri, file, output).content
+        read_manifest_store(signed)
+
+    with open(output_file, 'wb') as f:
+        f.write(signed)
+    print(f"Signed {file} with {output} output and saved to {output_file}")
+
+
 # Example manifest
 manifest = json.dumps({
     "claim_generator_info": [
@@ -158,16 +272,26 @@ parser = argparse.ArgumentParser(description="Sign files with C2PA.")
 parser.add_argument("files", metavar="F", type=str, nargs="+", help="Files to be signed")
 parser.add_argument("-o", "--output", type=str, required=True, help="Output directory")
 parser.add_argument("-f", "--envfile", type=str, required=False, help="Config environment file")
+parser.add_argument("--attach-output", type=str, required=False, choices=["full", "sidecar", "embeddable"],
+                    help="Sign with the server's /attach endpoint using this output mode, instead of remote signing")
+parser.add_argument("--jobs", action="store_true",
+                    help="Sign with asynchronous signing jobs instead of /attach (uses full output unless --attach-output is set)")
 
 args = parser.parse_args()
 
+if args.jobs and args.attach_output is None:
+    args.attach_output = "full"
+
 # Ensure the output directory exists
 os.makedirs(args.output, exist_ok=True)
 
-uri = get_signer_data_uri(args.envfile)
-print(f'Uri to get remote signer data {uri}')
+server_uri = get_server_uri(args.envfile)
+
+if args.attach_output is None:
+    uri = f'{server_uri}/signer_data'
+    print(f'Uri to get remote signer data {uri}')
 
-signer = get_remote_signer(uri)
+    signer = get_remote_signer(uri)
 
 
 # Sign each file and write to the output directory
@@ -180,6 +304,13 @@ for file in args.files:
         print(f"Output file {output_file} already exists, skipping...")
         continue
 
+    if args.attach_output is not None:
+        try:
+            sign_with_attach(server_uri, file, args.attach_output, output_file, args.jobs)
+        except Exception as e:
+            print(f"Failed to sign {file}: {e}")
+        continue
+
     try:
         with Builder(manifest) as builder:
             # Set the title for this ingredient